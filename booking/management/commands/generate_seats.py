@@ -1,13 +1,17 @@
+import os
+import string
+
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 
 from booking.models import Trip, Seat
 
-
-def row_letters(n: int):
-    # A, B, C, ... (cukup untuk bus normal)
-    for i in range(n):
-        yield chr(ord("A") + i)
+# Batch sebesar mungkin dalam batas 65535 bind-parameter Postgres
+# (ncols * 1.2 sebagai margin), bisa dioverride via env.
+BATCH_SIZE = int(
+    os.environ.get("SEAT_BULK_BATCH_SIZE")
+    or max(1, int(65535 // (len(Seat._meta.concrete_fields) * 1.2)))
+)
 
 
 class Command(BaseCommand):
@@ -59,32 +63,29 @@ class Command(BaseCommand):
             deleted, _ = Seat.objects.filter(trip=trip).delete()
             self.stdout.write(self.style.WARNING(f"Reset: hapus {deleted} seat."))
 
-        existing_codes = set(
-            Seat.objects.filter(trip=trip).values_list("code", flat=True)
-        )
-
-        seats_to_create = []
-        created_count = 0
-
-        for row in row_letters(rows):
-            for num in range(1, seats_per_row + 1):
-                code = f"{prefix}{row}{num}"
-                if code in existing_codes:
-                    continue
-                seats_to_create.append(
-                    Seat(trip=trip, code=code, status=Seat.Status.AVAILABLE)
-                )
-
+        # A, B, C, ... (cukup untuk bus normal); comprehension datar lebih
+        # cepat daripada generator + append dalam loop ganda
+        letters = string.ascii_uppercase[:rows]
+        codes = [
+            f"{prefix}{letter}{num}"
+            for letter in letters
+            for num in range(1, seats_per_row + 1)
+        ]
+
+        available = Seat.Status.AVAILABLE
+        seats_to_create = [
+            Seat(trip=trip, code=code, status=available) for code in codes
+        ]
+
+        # Dedup diserahkan ke DB lewat unique (trip, code) + ignore_conflicts,
+        # jadi tidak perlu pre-read semua kode existing ke Python.
         if seats_to_create:
-            Seat.objects.bulk_create(seats_to_create, batch_size=500)
-            created_count = len(seats_to_create)
-
-        # update capacity_total agar konsisten (optional)
-        total_seats = Seat.objects.filter(trip=trip).count()
-        if trip.capacity_total != total_seats:
-            trip.capacity_total = total_seats
-            trip.save(update_fields=["capacity_total"])
+            Seat.objects.bulk_create(
+                seats_to_create, batch_size=BATCH_SIZE, ignore_conflicts=True
+            )
 
+        # capacity_total dijaga trigger DB (lihat migration 0005), tidak
+        # perlu COUNT + save terpisah di sini
         self.stdout.write(self.style.SUCCESS(
-            f"Selesai. Dibuat {created_count} seat baru. Total seat trip sekarang: {total_seats}."
+            f"Selesai. {len(seats_to_create)} kode diproses (duplikat diabaikan DB)."
         ))
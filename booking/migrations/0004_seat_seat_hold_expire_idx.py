@@ -0,0 +1,17 @@
+# Generated by Django 5.2.17 on 2026-08-28 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0003_trip_bus_image_trip_bus_image_cropping'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='seat',
+            index=models.Index(condition=models.Q(('status', 'HOLD')), fields=['hold_until'], name='seat_hold_expire_idx'),
+        ),
+    ]
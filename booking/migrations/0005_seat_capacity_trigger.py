@@ -0,0 +1,84 @@
+from django.db import migrations
+
+# Trigger DB yang menjaga Trip.capacity_total setiap Seat di-insert/hapus,
+# supaya generate_seats (dan mutasi bulk lain) tidak perlu COUNT + save
+# terpisah dan nilainya tidak bisa drift.
+
+POSTGRES_FORWARD = """
+CREATE OR REPLACE FUNCTION booking_sync_capacity_total() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE booking_trip
+        SET capacity_total = (SELECT COUNT(*) FROM booking_seat WHERE trip_id = NEW.trip_id)
+        WHERE id = NEW.trip_id;
+        RETURN NEW;
+    ELSE
+        UPDATE booking_trip
+        SET capacity_total = (SELECT COUNT(*) FROM booking_seat WHERE trip_id = OLD.trip_id)
+        WHERE id = OLD.trip_id;
+        RETURN OLD;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER seat_capacity_sync
+AFTER INSERT OR DELETE ON booking_seat
+FOR EACH ROW EXECUTE FUNCTION booking_sync_capacity_total();
+"""
+
+POSTGRES_BACKWARD = """
+DROP TRIGGER IF EXISTS seat_capacity_sync ON booking_seat;
+DROP FUNCTION IF EXISTS booking_sync_capacity_total();
+"""
+
+SQLITE_FORWARD = """
+CREATE TRIGGER seat_capacity_sync_ins AFTER INSERT ON booking_seat
+BEGIN
+    UPDATE booking_trip
+    SET capacity_total = (SELECT COUNT(*) FROM booking_seat WHERE trip_id = NEW.trip_id)
+    WHERE id = NEW.trip_id;
+END;
+
+CREATE TRIGGER seat_capacity_sync_del AFTER DELETE ON booking_seat
+BEGIN
+    UPDATE booking_trip
+    SET capacity_total = (SELECT COUNT(*) FROM booking_seat WHERE trip_id = OLD.trip_id)
+    WHERE id = OLD.trip_id;
+END;
+"""
+
+SQLITE_BACKWARD = """
+DROP TRIGGER IF EXISTS seat_capacity_sync_ins;
+DROP TRIGGER IF EXISTS seat_capacity_sync_del;
+"""
+
+
+def _execute_all(schema_editor, sql: str):
+    for statement in sql.split("\n\n"):
+        if statement.strip():
+            schema_editor.execute(statement)
+
+
+def create_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        _execute_all(schema_editor, POSTGRES_FORWARD)
+    elif schema_editor.connection.vendor == "sqlite":
+        _execute_all(schema_editor, SQLITE_FORWARD)
+
+
+def drop_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        _execute_all(schema_editor, POSTGRES_BACKWARD)
+    elif schema_editor.connection.vendor == "sqlite":
+        _execute_all(schema_editor, SQLITE_BACKWARD)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("booking", "0004_seat_seat_hold_expire_idx"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.17 on 2026-08-28 18:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0005_seat_capacity_trigger'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='seat',
+            index=models.Index(fields=['trip', 'status', 'hold_token', 'hold_until'], name='seat_hold_lookup_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='seat',
+            index=models.Index(condition=models.Q(('status', 'HOLD')), fields=['trip', 'claim_code'], name='seat_claim_idx'),
+        ),
+    ]
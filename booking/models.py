@@ -67,7 +67,24 @@ class Seat(models.Model):
         indexes = [
             models.Index(fields=["trip", "status"]),
             models.Index(fields=["status", "hold_until"]),
+            # partial index: sweep expire_holds cuma menyentuh baris HOLD
+            models.Index(
+                fields=["hold_until"],
+                name="seat_hold_expire_idx",
+                condition=models.Q(status="HOLD"),
+            ),
             models.Index(fields=["claim_code"]),
+            # composite: menutup filter (trip, status, hold_token, hold_until)
+            # yang dipakai hampir semua service query
+            models.Index(
+                fields=["trip", "status", "hold_token", "hold_until"],
+                name="seat_hold_lookup_idx",
+            ),
+            models.Index(
+                fields=["trip", "claim_code"],
+                name="seat_claim_idx",
+                condition=models.Q(status="HOLD"),
+            ),
             models.Index(fields=["booking_code"]),  # ✅ optional, tapi bagus
         ]
 
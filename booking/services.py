@@ -1,11 +1,12 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from datetime import timedelta
-from typing import Iterable, Optional
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Optional
 
-from django.db import models, transaction
-from django.db.models import Q
+from django.core.cache import cache
+from django.db import connection, models, transaction
+from django.db.models.functions import Now
 from django.utils import timezone
 
 from .models import Seat, Trip
@@ -13,8 +14,11 @@ from .models import Seat, Trip
 HOLD_MINUTES_DEFAULT = 10
 MAX_HOLD_PER_SESSION_DEFAULT = 4
 
+TRIPS_CACHE_KEY = "trips:active:v1"
+TRIPS_CACHE_TTL = 30  # detik; data trip berubah paling cepat skala menit
 
-@dataclass
+
+@dataclass(slots=True, frozen=True)
 class ServiceResult:
     ok: bool
     message: str
@@ -25,38 +29,134 @@ def _now():
     return timezone.now()
 
 
+def _sfu_kwargs(skip_locked: bool = False) -> dict:
+    """
+    Argumen select_for_update sesuai kemampuan backend:
+    - of=("self",): lock hanya baris Seat, bukan baris Trip hasil join
+    - skip_locked: untuk operasi idempoten, lewati baris yang sedang di-lock
+    (SQLite di dev/test tidak mendukung keduanya, jadi dicek via features.)
+    """
+    kwargs: dict = {}
+    if connection.features.has_select_for_update_of:
+        kwargs["of"] = ("self",)
+    if skip_locked and connection.features.has_select_for_update_skip_locked:
+        kwargs["skip_locked"] = True
+    return kwargs
+
+
+def _coerce_db_datetime(value) -> datetime | None:
+    """
+    Nilai datetime dari cursor mentah (RETURNING): Postgres sudah berupa
+    datetime, SQLite berupa string naive UTC — samakan jadi aware datetime
+    seperti hasil ORM.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, dt_timezone.utc)
+    return value
+
+
 # -----------------------------
 # Housekeeping
 # -----------------------------
-def expire_holds() -> int:
+EXPIRE_BATCH_SIZE = 1000
+
+
+def expire_holds(batch_size: int = EXPIRE_BATCH_SIZE, now: datetime | None = None) -> int:
     """
     Release semua kursi HOLD yang sudah lewat hold_until.
+    Diproses per batch dengan SKIP LOCKED (di Postgres) supaya sweep tidak
+    memblokir hold_seat yang sedang berjalan dan lock scope tetap terbatas.
+    `now` bisa dioper caller supaya satu request cukup satu timezone.now().
     Return: jumlah seat yang direlease.
     """
-    now = _now()
-    qs = Seat.objects.filter(status=Seat.Status.HOLD, hold_until__lt=now)
-    updated = qs.update(
+    if now is None:
+        now = _now()
+    total = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                Seat.objects.select_for_update(**_sfu_kwargs(skip_locked=True))
+                .filter(status=Seat.Status.HOLD, hold_until__lt=now)
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            total += Seat.objects.filter(id__in=ids).update(
+                status=Seat.Status.AVAILABLE,
+                hold_token=None,
+                hold_until=None,
+                customer_name=None,
+                customer_wa=None,
+                claim_code=None,
+                # booking_code tidak dihapus di expire (karena hanya ada saat BOOKED)
+            )
+    return total
+
+
+def _maybe_expire_holds(trip_id: int, now: datetime | None = None) -> int:
+    """
+    Variant hemat untuk hot path read (seat map):
+    cek dulu pakai EXISTS (index-only), baru UPDATE kalau memang ada
+    hold yang expired — dan hanya untuk trip ini, bukan seluruh tabel.
+    """
+    if now is None:
+        now = _now()
+    qs = Seat.objects.filter(trip_id=trip_id, status=Seat.Status.HOLD, hold_until__lt=now)
+    if not qs.exists():
+        return 0
+    return qs.update(
         status=Seat.Status.AVAILABLE,
         hold_token=None,
         hold_until=None,
         customer_name=None,
         customer_wa=None,
         claim_code=None,
-        # booking_code tidak dihapus di expire (karena hanya ada saat BOOKED)
     )
-    return updated
 
 
 # -----------------------------
 # Queries
 # -----------------------------
-def list_trips() -> Iterable[Trip]:
-    return Trip.objects.filter(is_active=True).order_by("depart_at")
+def list_trips() -> list[dict]:
+    """
+    Daftar trip aktif (dict per trip), di-cache TRIPS_CACHE_TTL detik.
+    Cache diinvalidasi via signal post_save/post_delete Trip (signals.py).
+    """
+    return cache.get_or_set(
+        TRIPS_CACHE_KEY,
+        lambda: list(
+            Trip.objects.filter(is_active=True)
+            .order_by("depart_at")
+            .values(
+                "id",
+                "title",
+                "bus_type",
+                "route_from",
+                "route_to",
+                "depart_at",
+                "price",
+                "capacity_total",
+                "admin_wa",
+                "bus_image",
+            )
+        ),
+        TRIPS_CACHE_TTL,
+    )
+
+
+def invalidate_trips_cache(**kwargs) -> None:
+    cache.delete(TRIPS_CACHE_KEY)
 
 
 def get_trip_with_seats(trip_id: int) -> Optional[Trip]:
+    # Tidak pakai prefetch_related("seats"): seat map mem-filter/mengurutkan
+    # ulang queryset-nya sendiri, jadi prefetch cuma jadi query ekstra.
     try:
-        return Trip.objects.prefetch_related("seats").get(id=trip_id, is_active=True)
+        return Trip.objects.get(id=trip_id, is_active=True)
     except Trip.DoesNotExist:
         return None
 
@@ -64,16 +164,57 @@ def get_trip_with_seats(trip_id: int) -> Optional[Trip]:
 # -----------------------------
 # Public API payloads
 # -----------------------------
-def get_seat_map(trip_id: int) -> ServiceResult:
-    expire_holds()
+def _hold_until_iso_sql() -> models.Func:
+    """
+    Format ISO-8601 hold_until langsung di Postgres via to_char, supaya
+    Python tidak perlu materialize datetime + isoformat() per baris.
+    (to_char(NULL, ...) = NULL, jadi tidak perlu Case.)
+    """
+    return models.Func(
+        "hold_until",
+        models.Value('YYYY-MM-DD"T"HH24:MI:SS.USOF'),
+        function="to_char",
+        output_field=models.CharField(),
+    )
 
-    trip = get_trip_with_seats(trip_id)
-    if not trip:
-        return ServiceResult(False, "Trip tidak ditemukan.")
 
-    seats = trip.seats.order_by("code").all()
-    data = {
-        "trip": {
+def get_seat_map(trip_id: int) -> ServiceResult:
+    _maybe_expire_holds(trip_id)
+
+    # Satu query JOIN: kolom trip ikut di tiap baris seat, lalu dipecah
+    # di Python — hemat satu round-trip dibanding Trip.get + seat query.
+    fields = [
+        "trip__id",
+        "trip__title",
+        "trip__bus_type",
+        "trip__route_from",
+        "trip__route_to",
+        "trip__depart_at",
+        "trip__price",
+        "trip__capacity_total",
+        "trip__admin_wa",
+        "id",
+        "code",
+        "status",
+    ]
+
+    qs = Seat.objects.filter(trip_id=trip_id, trip__is_active=True)
+    sql_iso = connection.vendor == "postgresql"
+    if sql_iso:
+        qs = qs.annotate(hold_until_iso=_hold_until_iso_sql())
+        fields.append("hold_until_iso")
+    else:
+        # SQLite dev/test tidak punya to_char: isoformat di Python
+        fields.append("hold_until")
+
+    rows = list(qs.values(*fields).order_by("code"))
+
+    if not rows:
+        # bedakan "trip tidak ada" vs "trip ada tapi belum punya seat"
+        trip = get_trip_with_seats(trip_id)
+        if not trip:
+            return ServiceResult(False, "Trip tidak ditemukan.")
+        trip_data = {
             "id": trip.id,
             "title": trip.title,
             "bus_type": trip.bus_type,
@@ -83,32 +224,58 @@ def get_seat_map(trip_id: int) -> ServiceResult:
             "price": trip.price,
             "capacity_total": trip.capacity_total,
             "admin_wa": getattr(trip, "admin_wa", "") or "",  # ✅ versi B
-        },
-        "seats": [
-            {
-                "id": s.id,
-                "code": s.code,
-                "status": s.status,
-                "hold_until": s.hold_until.isoformat() if s.hold_until else None,
-                # booking_code tidak perlu ditampilkan public (opsional)
-            }
-            for s in seats
-        ],
+        }
+        return ServiceResult(True, "OK", data={"trip": trip_data, "seats": []})
+
+    first = rows[0]
+    trip_data = {
+        "id": first["trip__id"],
+        "title": first["trip__title"],
+        "bus_type": first["trip__bus_type"],
+        "route_from": first["trip__route_from"],
+        "route_to": first["trip__route_to"],
+        "depart_at": first["trip__depart_at"].isoformat(),
+        "price": first["trip__price"],
+        "capacity_total": first["trip__capacity_total"],
+        "admin_wa": first["trip__admin_wa"] or "",  # ✅ versi B
     }
-    return ServiceResult(True, "OK", data=data)
+    # booking_code tidak perlu ditampilkan public (opsional)
+    seats_data = [
+        {
+            "id": r["id"],
+            "code": r["code"],
+            "status": r["status"],
+            "hold_until": (
+                r["hold_until_iso"]
+                if sql_iso
+                else (r["hold_until"].isoformat() if r["hold_until"] else None)
+            ),
+        }
+        for r in rows
+    ]
+    return ServiceResult(True, "OK", data={"trip": trip_data, "seats": seats_data})
 
 
 # -----------------------------
 # Hold logic
 # -----------------------------
-def _count_holds_for_token(trip_id: int, hold_token: str) -> int:
-    now = _now()
-    return Seat.objects.filter(
-        trip_id=trip_id,
-        status=Seat.Status.HOLD,
-        hold_token=hold_token,
-        hold_until__gte=now,
-    ).count()
+def _session_holds_subquery(trip_id: int, hold_token: str, now: datetime) -> models.Subquery:
+    """
+    Subquery COUNT hold aktif milik token ini, untuk di-annotate ke
+    fetch utama supaya limit check tidak butuh round-trip terpisah.
+    """
+    return models.Subquery(
+        Seat.objects.filter(
+            trip_id=trip_id,
+            status=Seat.Status.HOLD,
+            hold_token=hold_token,
+            hold_until__gte=now,
+        )
+        .order_by()
+        .values("trip_id")
+        .annotate(c=models.Count("pk"))
+        .values("c")
+    )
 
 
 @transaction.atomic
@@ -122,18 +289,13 @@ def hold_seat(
     """
     Hold kursi secara atomic (anti dobel hold).
     """
-    expire_holds()
     now = _now()
 
-    # limit jumlah kursi yang bisa di-hold per token per trip
-    current_holds = _count_holds_for_token(trip_id, hold_token)
-    if current_holds >= max_hold_per_session:
-        return ServiceResult(False, f"Maksimal hold {max_hold_per_session} kursi.")
-
     try:
         seat = (
-            Seat.objects.select_for_update()
+            Seat.objects.select_for_update(**_sfu_kwargs())
             .select_related("trip")
+            .annotate(session_holds=_session_holds_subquery(trip_id, hold_token, now))
             .get(trip_id=trip_id, code=seat_code)
         )
     except Seat.DoesNotExist:
@@ -142,29 +304,59 @@ def hold_seat(
     if seat.status == Seat.Status.BOOKED:
         return ServiceResult(False, "Kursi sudah terisi (BOOKED).")
 
+    already_mine = (
+        seat.status == Seat.Status.HOLD
+        and seat.hold_until is not None
+        and seat.hold_until >= now
+        and seat.hold_token == hold_token
+    )
+
+    # limit jumlah kursi yang bisa di-hold per token per trip
+    # (refresh hold milik sendiri tidak kena limit)
+    if not already_mine and (seat.session_holds or 0) >= max_hold_per_session:
+        return ServiceResult(False, f"Maksimal hold {max_hold_per_session} kursi.")
+
     # sedang di-hold oleh orang lain dan belum expired
     if seat.status == Seat.Status.HOLD and seat.hold_until and seat.hold_until >= now:
         if seat.hold_token != hold_token:
             return ServiceResult(False, "Kursi sedang di-hold user lain.")
 
-        # token sama -> refresh hold
+        # token sama -> refresh hold; nilai baru dihitung DB (Now()),
+        # tanpa read-modify-write + save() di Python
+        Seat.objects.filter(pk=seat.pk).update(
+            hold_until=Now() + timedelta(minutes=hold_minutes),
+            updated_at=Now(),
+        )
+        # approksimasi untuk payload; nilai otoritatif ada di DB
         seat.hold_until = now + timedelta(minutes=hold_minutes)
-        seat.save(update_fields=["hold_until", "updated_at"])
         return ServiceResult(True, "Hold diperpanjang.", data=_seat_payload(seat))
 
-    # available / hold expired -> ambil
+    # available / hold expired -> ambil lewat satu UPDATE bertarget
+    # (guard status di WHERE; tanpa full save() yang menulis semua kolom)
+    updated = Seat.objects.filter(
+        pk=seat.pk,
+        status__in=[Seat.Status.AVAILABLE, Seat.Status.HOLD],
+    ).update(
+        status=Seat.Status.HOLD,
+        hold_token=hold_token,
+        hold_until=Now() + timedelta(minutes=hold_minutes),
+        # bersihkan data lama (safety)
+        customer_name=None,
+        customer_wa=None,
+        claim_code=None,
+        booked_at=None,
+        booking_code=None,  # ✅ versi B: jangan ada booking_code kalau belum BOOKED
+        updated_at=Now(),
+    )
+    if not updated:
+        return ServiceResult(False, "Kursi sudah terisi (BOOKED).")
+
+    # sinkronkan instance untuk payload (nilai otoritatif ada di DB)
     seat.status = Seat.Status.HOLD
     seat.hold_token = hold_token
     seat.hold_until = now + timedelta(minutes=hold_minutes)
-
-    # bersihkan data lama (safety)
-    seat.customer_name = None
-    seat.customer_wa = None
     seat.claim_code = None
-    seat.booked_at = None
-    seat.booking_code = None  # ✅ versi B: jangan ada booking_code kalau belum BOOKED
-
-    seat.save()
+    seat.booking_code = None
     return ServiceResult(True, "Kursi berhasil di-hold.", data=_seat_payload(seat))
 
 
@@ -173,11 +365,10 @@ def release_seat(trip_id: int, seat_code: str, hold_token: str) -> ServiceResult
     """
     User release kursi yang dia hold sendiri.
     """
-    expire_holds()
     now = _now()
 
     try:
-        seat = Seat.objects.select_for_update().get(trip_id=trip_id, code=seat_code)
+        seat = Seat.objects.select_for_update(**_sfu_kwargs()).get(trip_id=trip_id, code=seat_code)
     except Seat.DoesNotExist:
         return ServiceResult(False, "Kursi tidak ditemukan.")
 
@@ -214,7 +405,6 @@ def attach_contact_and_generate_claim(
     - generate claim_code (1 kode untuk semua seat hold user pada trip tsb)
     - return admin_wa supaya frontend bisa redirect ke WA admin (versi B)
     """
-    expire_holds()
     now = _now()
 
     # ambil trip untuk admin_wa (versi B)
@@ -223,30 +413,33 @@ def attach_contact_and_generate_claim(
     except Trip.DoesNotExist:
         return ServiceResult(False, "Trip tidak ditemukan.")
 
-    seats = (
-        Seat.objects.select_for_update()
-        .filter(
-            trip_id=trip_id,
-            status=Seat.Status.HOLD,
-            hold_token=hold_token,
-            hold_until__gte=now,
+    claim_code = Seat.generate_claim_code()
+
+    # satu UPDATE ... RETURNING, menggantikan exists + update + values_list
+    # + aggregate (4 query jadi 1); UPDATE sendiri sudah mengunci barisnya
+    table = Seat._meta.db_table
+    with connection.cursor() as cur:
+        cur.execute(
+            f"UPDATE {table} SET customer_name = %s, customer_wa = %s, claim_code = %s "
+            f"WHERE trip_id = %s AND status = %s AND hold_token = %s AND hold_until >= %s "
+            f"RETURNING code, hold_until",
+            [
+                customer_name.strip(),
+                customer_wa.strip(),
+                claim_code,
+                trip_id,
+                Seat.Status.HOLD.value,
+                hold_token,
+                now,
+            ],
         )
-        .order_by("code")
-    )
+        rows = cur.fetchall()
 
-    if not seats.exists():
+    if not rows:
         return ServiceResult(False, "Tidak ada kursi hold aktif untuk token ini.")
 
-    claim_code = Seat.generate_claim_code()
-
-    seats.update(
-        customer_name=customer_name.strip(),
-        customer_wa=customer_wa.strip(),
-        claim_code=claim_code,
-    )
-
-    seat_codes = list(seats.values_list("code", flat=True))
-    hold_until_max = seats.aggregate(mx=models.Max("hold_until"))["mx"]  # type: ignore
+    seat_codes = sorted(r[0] for r in rows)
+    hold_until_max = _coerce_db_datetime(max(r[1] for r in rows))
 
     return ServiceResult(
         True,
@@ -271,26 +464,34 @@ def claim_hold_by_code(
     Klaim ulang hold menggunakan claim_code (dan opsional cocokkan nomor WA).
     Pindahkan hold_token ke token baru (browser/device baru).
     """
-    expire_holds()
     now = _now()
 
-    q = Q(
-        trip_id=trip_id,
-        status=Seat.Status.HOLD,
-        hold_until__gte=now,
-        claim_code=claim_code.strip().upper(),
-    )
+    table = Seat._meta.db_table
+    where = "trip_id = %s AND status = %s AND hold_until >= %s AND claim_code = %s"
+    params: list = [
+        new_hold_token,
+        trip_id,
+        Seat.Status.HOLD.value,
+        now,
+        claim_code.strip().upper(),
+    ]
     if customer_wa:
-        q &= Q(customer_wa=customer_wa.strip())
+        where += " AND customer_wa = %s"
+        params.append(customer_wa.strip())
+
+    # satu UPDATE ... RETURNING (lihat attach_contact_and_generate_claim)
+    with connection.cursor() as cur:
+        cur.execute(
+            f"UPDATE {table} SET hold_token = %s WHERE {where} RETURNING code, hold_until",
+            params,
+        )
+        rows = cur.fetchall()
 
-    seats = Seat.objects.select_for_update().filter(q).order_by("code")
-    if not seats.exists():
+    if not rows:
         return ServiceResult(False, "Claim code tidak valid atau sudah expired.")
 
-    seats.update(hold_token=new_hold_token)
-
-    seat_codes = list(seats.values_list("code", flat=True))
-    hold_until_max = seats.aggregate(mx=models.Max("hold_until"))["mx"]  # type: ignore
+    seat_codes = sorted(r[0] for r in rows)
+    hold_until_max = _coerce_db_datetime(max(r[1] for r in rows))
 
     return ServiceResult(
         True,
@@ -305,6 +506,57 @@ def claim_hold_by_code(
 # -----------------------------
 # Admin: BOOKED + booking_code (Versi B)
 # -----------------------------
+def _book_seats_returning(
+    trip_id: int,
+    seat_codes: list[str],
+    now: datetime,
+    booking_code: str | None = None,
+) -> list[str]:
+    """
+    Satu statement UPDATE ... RETURNING: set BOOKED semua kursi yang belum
+    BOOKED, kembalikan kode yang berhasil diupdate. DB menjaga invariannya
+    atomic — tanpa SELECT FOR UPDATE + COUNT + filter terpisah.
+    """
+    table = Seat._meta.db_table
+    placeholders = ", ".join(["%s"] * len(seat_codes))
+    set_booking = ", booking_code = %s" if booking_code is not None else ""
+
+    params: list = [Seat.Status.BOOKED.value, now]
+    if booking_code is not None:
+        params.append(booking_code)
+    params += [trip_id, *seat_codes, Seat.Status.BOOKED.value]
+
+    with connection.cursor() as cur:
+        cur.execute(
+            f"UPDATE {table} "
+            f"SET status = %s, booked_at = %s, hold_token = NULL, hold_until = NULL{set_booking} "
+            f"WHERE trip_id = %s AND code IN ({placeholders}) AND status <> %s "
+            f"RETURNING code",
+            params,
+        )
+        return [row[0] for row in cur.fetchall()]
+
+
+def _classify_book_failure(
+    trip_id: int, seat_codes: list[str], updated_codes: list[str]
+) -> ServiceResult:
+    """
+    UPDATE tidak mengenai semua kursi yang diminta: bedakan "kursi tidak
+    ada" vs "sudah BOOKED", lalu tandai rollback supaya update parsial
+    tidak ikut ter-commit.
+    """
+    existing = set(
+        Seat.objects.filter(trip_id=trip_id, code__in=seat_codes).values_list("code", flat=True)
+    )
+    transaction.set_rollback(True)
+
+    if len(existing) != len(seat_codes):
+        return ServiceResult(False, "Ada kursi yang tidak ditemukan.")
+
+    already_booked = [c for c in seat_codes if c not in set(updated_codes)]
+    return ServiceResult(False, f"Kursi sudah BOOKED: {', '.join(already_booked)}")
+
+
 @transaction.atomic
 def admin_generate_booking_code_and_book(trip_id: int, seat_codes: list[str]) -> ServiceResult:
     """
@@ -313,26 +565,12 @@ def admin_generate_booking_code_and_book(trip_id: int, seat_codes: list[str]) ->
     - Set seat status menjadi BOOKED + booked_at
     - booking_code disimpan di seat
     """
-    expire_holds()
     now = _now()
-
-    seats = Seat.objects.select_for_update().filter(trip_id=trip_id, code__in=seat_codes)
-    if seats.count() != len(seat_codes):
-        return ServiceResult(False, "Ada kursi yang tidak ditemukan.")
-
-    already_booked = list(seats.filter(status=Seat.Status.BOOKED).values_list("code", flat=True))
-    if already_booked:
-        return ServiceResult(False, f"Kursi sudah BOOKED: {', '.join(already_booked)}")
-
     booking_code = Seat.generate_booking_code()
 
-    seats.update(
-        status=Seat.Status.BOOKED,
-        booked_at=now,
-        booking_code=booking_code,
-        hold_token=None,
-        hold_until=None,
-    )
+    updated_codes = _book_seats_returning(trip_id, seat_codes, now, booking_code=booking_code)
+    if len(updated_codes) != len(seat_codes):
+        return _classify_book_failure(trip_id, seat_codes, updated_codes)
 
     return ServiceResult(
         True,
@@ -350,23 +588,11 @@ def confirm_booked_by_admin(trip_id: int, seat_codes: list[str]) -> ServiceResul
     Endpoint lama: hanya set BOOKED tanpa booking_code.
     Masih boleh dipakai, tapi untuk versi B lebih baik gunakan admin_generate_booking_code_and_book().
     """
-    expire_holds()
     now = _now()
 
-    seats = Seat.objects.select_for_update().filter(trip_id=trip_id, code__in=seat_codes)
-    if seats.count() != len(seat_codes):
-        return ServiceResult(False, "Ada kursi yang tidak ditemukan.")
-
-    already_booked = list(seats.filter(status=Seat.Status.BOOKED).values_list("code", flat=True))
-    if already_booked:
-        return ServiceResult(False, f"Kursi sudah BOOKED: {', '.join(already_booked)}")
-
-    seats.update(
-        status=Seat.Status.BOOKED,
-        booked_at=now,
-        hold_token=None,
-        hold_until=None,
-    )
+    updated_codes = _book_seats_returning(trip_id, seat_codes, now)
+    if len(updated_codes) != len(seat_codes):
+        return _classify_book_failure(trip_id, seat_codes, updated_codes)
 
     return ServiceResult(True, "Kursi berhasil dikonfirmasi BOOKED.", data={"seat_codes": seat_codes})
 
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Trip
+from .services import invalidate_trips_cache
+
+
+@receiver(post_save, sender=Trip)
+@receiver(post_delete, sender=Trip)
+def trip_changed(sender, **kwargs):
+    # list_trips() di-cache; hapus cache tiap ada perubahan Trip
+    invalidate_trips_cache()
@@ -18,11 +18,10 @@ class BookingServiceTests(TestCase):
             capacity_total=4,
             is_active=True,
         )
-        # Buat 4 kursi untuk test
-        Seat.objects.create(trip=self.trip, code="A1")
-        Seat.objects.create(trip=self.trip, code="A2")
-        Seat.objects.create(trip=self.trip, code="A3")
-        Seat.objects.create(trip=self.trip, code="A4")
+        # Buat 4 kursi untuk test (satu INSERT batch, bukan 4)
+        Seat.objects.bulk_create(
+            [Seat(trip=self.trip, code=c) for c in ("A1", "A2", "A3", "A4")]
+        )
 
         self.token_a = "tokenA"
         self.token_b = "tokenB"
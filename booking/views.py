@@ -86,15 +86,19 @@ def trips_list(request: HttpRequest):
 
     data = [
         {
-            "id": t.id,
-            "title": t.title,
-            "bus_type": t.bus_type,
-            "route_from": t.route_from,
-            "route_to": t.route_to,
-            "depart_at": t.depart_at.isoformat(),
-            "price": t.price,
-            "capacity_total": t.capacity_total,
-            "bus_image_url": request.build_absolute_uri(t.bus_image.url) if getattr(t, "bus_image", None) else "",
+            "id": t["id"],
+            "title": t["title"],
+            "bus_type": t["bus_type"],
+            "route_from": t["route_from"],
+            "route_to": t["route_to"],
+            "depart_at": t["depart_at"].isoformat(),
+            "price": t["price"],
+            "capacity_total": t["capacity_total"],
+            "bus_image_url": (
+                request.build_absolute_uri(settings.MEDIA_URL + t["bus_image"])
+                if t["bus_image"]
+                else ""
+            ),
         }
         for t in trips
     ]